@@ -0,0 +1,13 @@
+import json
+import logging
+from types import MappingProxyType
+
+# Load config once and share a read-only view with every module
+with open("config.json", "r") as f:
+    config = MappingProxyType(json.load(f))
+
+# Set up logging
+logging.basicConfig(
+    level=getattr(logging, config.get("log_level", "INFO").upper()),
+    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
+)
@@ -1,24 +1,52 @@
 import os
 import sqlite3
-import json
-from datetime import datetime
-from sqlalchemy import Column, Integer, String, DateTime, Text, create_engine, ForeignKey
+from sqlalchemy import Column, Integer, String, DateTime, Text, create_engine, ForeignKey, Index, event, func, inspect, text
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.schema import CreateIndex, DropIndex
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker, relationship
 
-# Load config
-with open("config.json", "r") as f:
-    config = json.load(f)
+from config import config
 
 # Ensure data directory exists
 os.makedirs(os.path.dirname(config["db_path"]), exist_ok=True)
 
 # Database setup
 SQLALCHEMY_DATABASE_URL = f"sqlite:///{config['db_path']}"
-engine = create_engine(SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False})
+# Sized for one session per request plus the simulator and WebSocket clients,
+# so bursts don't exhaust the default 5 + 10 QueuePool
+engine = create_engine(
+    SQLALCHEMY_DATABASE_URL,
+    connect_args={"check_same_thread": False},
+    pool_size=20,
+    max_overflow=40,
+    pool_timeout=30,
+    pool_recycle=3600,
+    pool_pre_ping=True,
+)
+
+# Tune every new SQLite connection. WAL lets readers run alongside the writer
+# and creates the -wal/-shm files next to the database, which is expected.
+@event.listens_for(engine, "connect")
+def set_sqlite_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute("PRAGMA cache_size=-64000")  # ~64 MB page cache
+    cursor.execute("PRAGMA temp_store=MEMORY")
+    cursor.execute("PRAGMA mmap_size=268435456")  # 256 MB
+    cursor.execute("PRAGMA foreign_keys=ON")
+    cursor.close()
+
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 Base = declarative_base()
 
+# Current UTC time generated by SQLite, optionally shifted by date modifiers
+# such as "-24 hours". CURRENT_TIMESTAMP only has second resolution, which
+# misorders scans recorded within the same second.
+def utc_now(*modifiers):
+    return func.strftime("%Y-%m-%d %H:%M:%f", "now", *modifiers)
+
 class Asset(Base):
     __tablename__ = "assets"
     
@@ -28,9 +56,14 @@ class Asset(Base):
     description = Column(Text, nullable=True)
     asset_type = Column(String, index=True)
     status = Column(String, default="active")  # active, missing, idle
-    created_at = Column(DateTime, default=datetime.utcnow)
-    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
-    scans = relationship("Scan", back_populates="asset", cascade="all, delete-orphan")
+    # Timestamps are generated by SQLite at write time. server_default covers new
+    # tables; default= keeps tables created before it from getting NULLs.
+    created_at = Column(DateTime, default=utc_now(), server_default=utc_now())
+    updated_at = Column(DateTime, default=utc_now(), server_default=utc_now(), onupdate=utc_now())
+    # Copied from the most recent scan by the scan writers, so reads need no join
+    last_seen_at = Column(DateTime, nullable=True, index=True)
+    last_location = Column(String, nullable=True)
+    scans = relationship("Scan", back_populates="asset", cascade="all, delete-orphan", order_by="[desc(Scan.timestamp), desc(Scan.id)]")
 
 class Scan(Base):
     __tablename__ = "scans"
@@ -38,13 +71,63 @@ class Scan(Base):
     id = Column(Integer, primary_key=True, index=True)
     asset_id = Column(Integer, ForeignKey("assets.id"))
     location = Column(String, index=True)
-    timestamp = Column(DateTime, default=datetime.utcnow)
+    timestamp = Column(DateTime, default=utc_now(), server_default=utc_now())
     rssi = Column(Integer, nullable=True)  # Signal strength (simulated)
     asset = relationship("Asset", back_populates="scans")
+    
+    # Serves "latest scan per asset" lookups with an index seek instead of a scan + sort;
+    # id breaks ties between scans with the same timestamp
+    __table_args__ = (
+        Index("ix_scans_asset_ts", asset_id, timestamp.desc(), id.desc()),
+    )
+    # Fetch the database-generated timestamp with RETURNING on insert
+    __mapper_args__ = {"eager_defaults": True}
 
 # Create tables
-def init_db():
-    Base.metadata.create_all(bind=engine)
+def init_db(bind=engine):
+    Base.metadata.create_all(bind=bind)
+
+# Copy each asset's latest scan onto its denormalized last-scan columns
+sync_last_scan_columns = text("""
+    UPDATE assets SET
+        last_seen_at = (SELECT MAX(timestamp) FROM scans WHERE scans.asset_id = assets.id),
+        last_location = (SELECT location FROM scans WHERE scans.asset_id = assets.id
+                         ORDER BY timestamp DESC, id DESC LIMIT 1)
+""")
+
+# Create or upgrade the database schema in place
+def migrate_db():
+    with engine.connect() as connection:
+        # Every step below checks the schema and then changes it. Take the write
+        # lock up front so workers starting together apply them one at a time.
+        connection.exec_driver_sql("BEGIN IMMEDIATE")
+        init_db(connection)
+        
+        # Add the denormalized last-scan columns and fill them from scan history
+        columns = {column["name"] for column in inspect(connection).get_columns("assets")}
+        added = False
+        for name, column_type in (("last_seen_at", "DATETIME"), ("last_location", "VARCHAR")):
+            if name not in columns:
+                connection.execute(text(f"ALTER TABLE assets ADD COLUMN {name} {column_type}"))
+                added = True
+        if added:
+            connection.execute(sync_last_scan_columns)
+        
+        # create_all only adds indexes together with new tables, so create any
+        # index introduced after the database file was first generated, and
+        # rebuild indexes whose columns have changed since
+        for table in Base.metadata.sorted_tables:
+            existing = {
+                index["name"]: index["column_names"]
+                for index in inspect(connection).get_indexes(table.name)
+            }
+            for index in table.indexes:
+                columns = [column.name for column in index.columns]
+                if index.name in existing and existing[index.name] != columns:
+                    connection.execute(DropIndex(index))
+                connection.execute(CreateIndex(index, if_not_exists=True))
+        
+        connection.commit()
 
 # Database dependency
 def get_db():
@@ -54,11 +137,12 @@ def get_db():
     finally:
         db.close()
 
-# Initialize database with sample data if it doesn't exist
+# Initialize database with sample data if it has no assets yet
 def init_sample_data():
-    if not os.path.exists(config["db_path"]) or os.path.getsize(config["db_path"]) == 0:
-        init_db()
-        db = SessionLocal()
+    db = SessionLocal()
+    try:
+        if db.execute(text("SELECT 1 FROM assets LIMIT 1")).first():
+            return
         
         # Sample assets
         sample_assets = [
@@ -72,16 +156,21 @@ def init_sample_data():
         for asset in sample_assets:
             db.add(asset)
         
-        db.commit()
+        # Flush to assign asset IDs without ending the transaction
+        db.flush()
         
-        # Sample scans
-        for asset in db.query(Asset).all():
-            initial_scan = Scan(
-                asset_id=asset.id,
-                location="Office",
-                rssi=-50
-            )
-            db.add(initial_scan)
+        # Sample scans, written as a single executemany
+        db.bulk_insert_mappings(Scan, [
+            {"asset_id": asset.id, "location": "Office", "rssi": -50}
+            for asset in sample_assets
+        ])
+        
+        # Record the initial scans as each asset's last sighting
+        db.execute(sync_last_scan_columns)
         
         db.commit()
-        db.close() 
\ No newline at end of file
+    except IntegrityError:
+        # Another worker seeded the database first
+        db.rollback()
+    finally:
+        db.close()
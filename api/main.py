@@ -1,17 +1,18 @@
-import json
 import asyncio
 import logging
 import os
 import sys
 import random
-from datetime import datetime, timedelta
-from typing import List, Dict, Any, Optional
+from datetime import datetime
+from typing import List, Dict, Any, Optional, Set
 from contextlib import asynccontextmanager
 
+import orjson
 import uvicorn
-from fastapi import FastAPI, Depends, HTTPException, WebSocket, WebSocketDisconnect, BackgroundTasks
+from fastapi import FastAPI, Depends, HTTPException, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import JSONResponse
+from sqlalchemy import bindparam, select, update
 from sqlalchemy.orm import Session
 from pydantic import BaseModel
 
@@ -19,28 +20,46 @@ from pydantic import BaseModel
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 # Import local modules
-from db import get_db, Asset, Scan, init_sample_data
+from config import config
+from db import get_db, SessionLocal, Asset, Scan, init_sample_data, migrate_db, utc_now
 from mock_data import RFIDSimulator
 
-# Load config
-with open("config.json", "r") as f:
-    config = json.load(f)
-
-# Set up logging
-logging.basicConfig(
-    level=getattr(logging, config.get("log_level", "INFO").upper()),
-    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
-)
 logger = logging.getLogger("asset_tracker_api")
 
-# Initialize database with sample data
-init_sample_data()
-
 # Initialize RFID simulator
 simulator = RFIDSimulator()
 
-# WebSocket connections
-active_connections: List[WebSocket] = []
+# Asset metadata keyed by tag ID, so scan paths don't query the assets table
+asset_cache: Dict[str, Dict[str, Any]] = {}
+
+def refresh_asset_cache(db: Session):
+    """Reload the asset cache from the database and share its tag IDs with the simulator"""
+    # Select just the cached columns rather than materializing every Asset object
+    rows = db.execute(select(Asset.tag_id, Asset.id, Asset.name, Asset.asset_type))
+    assets = {
+        row.tag_id: {"id": row.id, "name": row.name, "asset_type": row.asset_type}
+        for row in rows
+    }
+    asset_cache.clear()
+    asset_cache.update(assets)
+    simulator.tag_ids = list(asset_cache)
+
+# Tag lookup for cache misses, built once so SQLAlchemy reuses the compiled SQL
+asset_by_tag_query = (
+    select(Asset.id, Asset.name, Asset.asset_type)
+    .where(Asset.tag_id == bindparam("tag_id"))
+)
+
+def lookup_asset(db: Session, tag_id: str) -> Optional[Dict[str, Any]]:
+    """Find asset metadata by tag ID, reading through to the database on a cache miss"""
+    asset = asset_cache.get(tag_id)
+    if asset is None:
+        row = db.execute(asset_by_tag_query, {"tag_id": tag_id}).first()
+        if row:
+            asset = {"id": row.id, "name": row.name, "asset_type": row.asset_type}
+            asset_cache[tag_id] = asset
+            simulator.tag_ids = list(asset_cache)
+    return asset
 
 # Pydantic models
 class ScanRequest(BaseModel):
@@ -50,7 +69,7 @@ class ScanRequest(BaseModel):
 class ScanResponse(BaseModel):
     tag_id: str
     location: str
-    timestamp: str
+    timestamp: datetime
     asset_name: Optional[str] = None
     asset_type: Optional[str] = None
 
@@ -61,62 +80,72 @@ class AssetModel(BaseModel):
     description: Optional[str] = None
     asset_type: str
     status: str
-    last_seen: Optional[str] = None
+    last_seen: Optional[datetime] = None
     last_location: Optional[str] = None
 
 # WebSocket connection manager
 class ConnectionManager:
     def __init__(self):
-        self.active_connections: List[WebSocket] = []
+        self.active_connections: Set[WebSocket] = set()
 
     async def connect(self, websocket: WebSocket):
         await websocket.accept()
-        self.active_connections.append(websocket)
+        self.active_connections.add(websocket)
 
     def disconnect(self, websocket: WebSocket):
-        if websocket in self.active_connections:
-            self.active_connections.remove(websocket)
-
-    async def send_message(self, message: dict, websocket: WebSocket):
-        try:
-            if websocket.client_state.CONNECTED:
-                await websocket.send_json(message)
-        except Exception as e:
-            logger.debug(f"Error sending WebSocket message to a client: {str(e)}")
-            # Silent fail for individual client errors
+        self.active_connections.discard(websocket)
 
     async def broadcast(self, message: dict):
-        disconnected_clients = []
-        for connection in self.active_connections:
-            try:
-                if connection.client_state.CONNECTED:
-                    await connection.send_json(message)
-            except Exception as e:
-                logger.debug(f"Removing disconnected client: {str(e)}")
-                disconnected_clients.append(connection)
+        # Serialize once and send to every client concurrently. Frames stay
+        # text, since the dashboard JSON.parse()s them.
+        payload = orjson.dumps(message).decode()
+        connections = tuple(self.active_connections)
+        results = await asyncio.gather(
+            *(connection.send_text(payload) for connection in connections),
+            return_exceptions=True,
+        )
         
         # Clean up disconnected clients
-        for connection in disconnected_clients:
-            if connection in self.active_connections:
-                self.active_connections.remove(connection)
+        for connection, result in zip(connections, results):
+            if isinstance(result, Exception):
+                logger.debug(f"Removing disconnected client: {str(result)}")
+                self.disconnect(connection)
 
 # Initialize connection manager
 manager = ConnectionManager()
 
+async def broadcast_scan(scan_data):
+    """Add asset information to a simulated scan event and send it to every WebSocket client"""
+    asset = asset_cache.get(scan_data["tag_id"])
+    if asset:
+        scan_data = {**scan_data, "asset_name": asset["name"], "asset_type": asset["asset_type"]}
+    await manager.broadcast(scan_data)
+
 # Lifespan context manager for startup and shutdown events
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    # Startup: Initialize the RFID simulator if enabled in config
+    # Startup: Apply schema upgrades and seed sample data on first run
+    migrate_db()
+    init_sample_data()
+    
+    # Startup: Load asset metadata used by the scan paths
+    db = SessionLocal()
+    try:
+        refresh_asset_cache(db)
+    finally:
+        db.close()
+    
+    # Startup: Fan simulated scans out to WebSocket clients, then initialize
+    # the RFID simulator if enabled in config (its tag IDs come from the asset cache)
+    subscriber_id = simulator.subscribe(broadcast_scan)
     if config.get("simulate_auto_scan", False):
-        # Create a DB session for the simulator
-        db = next(get_db())
-        simulator.db_session = db
         await simulator.start_simulation()
     
     yield  # This is where FastAPI runs
     
     # Shutdown: Stop the RFID simulator
     await simulator.stop_simulation()
+    simulator.unsubscribe(subscriber_id)
 
 # Create FastAPI app
 app = FastAPI(title="RFID Asset Tracker API", lifespan=lifespan)
@@ -135,55 +164,36 @@ app.add_middleware(
 def read_root():
     return {"message": "RFID Asset Tracker API"}
 
+# Columns served by the asset endpoints, read as plain rows without ORM objects
+asset_model_query = select(
+    Asset.id,
+    Asset.tag_id,
+    Asset.name,
+    Asset.description,
+    Asset.asset_type,
+    Asset.status,
+    Asset.last_seen_at.label("last_seen"),
+    Asset.last_location,
+)
+
 @app.get("/api/assets", response_model=List[AssetModel])
 def get_assets(status: Optional[str] = None, db: Session = Depends(get_db)):
     """Get all assets with optional filtering by status"""
-    query = db.query(Asset)
+    query = asset_model_query
     
     if status:
-        query = query.filter(Asset.status == status)
-    
-    assets = query.all()
-    result = []
+        query = query.where(Asset.status == status)
     
-    for asset in assets:
-        # Get the most recent scan for each asset
-        last_scan = db.query(Scan).filter(Scan.asset_id == asset.id).order_by(Scan.timestamp.desc()).first()
-        
-        asset_data = {
-            "id": asset.id,
-            "tag_id": asset.tag_id,
-            "name": asset.name,
-            "description": asset.description,
-            "asset_type": asset.asset_type,
-            "status": asset.status,
-            "last_seen": last_scan.timestamp.isoformat() if last_scan else None,
-            "last_location": last_scan.location if last_scan else None
-        }
-        result.append(asset_data)
-    
-    return result
+    return [row._asdict() for row in db.execute(query)]
 
 @app.get("/api/assets/{asset_id}", response_model=AssetModel)
 def get_asset(asset_id: int, db: Session = Depends(get_db)):
     """Get a specific asset by ID"""
-    asset = db.query(Asset).filter(Asset.id == asset_id).first()
+    asset = db.execute(asset_model_query.where(Asset.id == asset_id)).first()
     if not asset:
         raise HTTPException(status_code=404, detail="Asset not found")
     
-    # Get the most recent scan
-    last_scan = db.query(Scan).filter(Scan.asset_id == asset.id).order_by(Scan.timestamp.desc()).first()
-    
-    return {
-        "id": asset.id,
-        "tag_id": asset.tag_id,
-        "name": asset.name,
-        "description": asset.description,
-        "asset_type": asset.asset_type,
-        "status": asset.status,
-        "last_seen": last_scan.timestamp.isoformat() if last_scan else None,
-        "last_location": last_scan.location if last_scan else None
-    }
+    return asset._asdict()
 
 @app.get("/api/assets/{asset_id}/scans")
 def get_asset_scans(asset_id: int, limit: int = 10, db: Session = Depends(get_db)):
@@ -192,53 +202,57 @@ def get_asset_scans(asset_id: int, limit: int = 10, db: Session = Depends(get_db
     if not asset:
         raise HTTPException(status_code=404, detail="Asset not found")
     
-    scans = db.query(Scan).filter(Scan.asset_id == asset_id).order_by(Scan.timestamp.desc()).limit(limit).all()
+    scans = db.query(Scan).filter(Scan.asset_id == asset_id).order_by(Scan.timestamp.desc(), Scan.id.desc()).limit(limit).all()
     
     return [
         {
             "id": scan.id,
             "location": scan.location,
-            "timestamp": scan.timestamp.isoformat(),
+            "timestamp": scan.timestamp,
             "rssi": scan.rssi
         }
         for scan in scans
     ]
 
 @app.post("/api/scan", response_model=ScanResponse)
-async def create_scan(scan_request: ScanRequest, background_tasks: BackgroundTasks, db: Session = Depends(get_db)):
+async def create_scan(scan_request: ScanRequest, db: Session = Depends(get_db)):
     """Create a manual scan event"""
     # Find the asset by tag ID
-    asset = db.query(Asset).filter(Asset.tag_id == scan_request.tag_id).first()
+    asset = lookup_asset(db, scan_request.tag_id)
     if not asset:
         raise HTTPException(status_code=404, detail="Asset with this tag ID not found")
     
-    # Create a new scan record
+    # Create a new scan record; the database assigns its timestamp
     new_scan = Scan(
-        asset_id=asset.id,
+        asset_id=asset["id"],
         location=scan_request.location,
         rssi=random.randint(-70, -30)  # Simulated signal strength
     )
     db.add(new_scan)
+    db.flush()
     
-    # Update asset status and timestamps
-    asset.status = "active"
-    asset.updated_at = datetime.utcnow()
-    db.commit()
-    
-    # Generate scan event for WebSocket clients
-    background_tasks.add_task(
-        simulator.generate_specific_scan, 
-        scan_request.tag_id, 
-        scan_request.location
-    )
+    # Update asset status and last known position (updated_at is set on UPDATE).
+    # last_seen_at copies the stored timestamp text, keeping one format in the column.
+    db.query(Asset).filter(Asset.id == asset["id"]).update({
+        "status": "active",
+        "last_seen_at": select(Scan.timestamp).where(Scan.id == new_scan.id).scalar_subquery(),
+        "last_location": scan_request.location,
+    })
     
-    return {
+    scan_data = {
         "tag_id": scan_request.tag_id,
         "location": scan_request.location,
-        "timestamp": new_scan.timestamp.isoformat(),
-        "asset_name": asset.name,
-        "asset_type": asset.asset_type
+        "timestamp": new_scan.timestamp,
+        "rssi": new_scan.rssi,
+        "asset_name": asset["name"],
+        "asset_type": asset["asset_type"],
     }
+    db.commit()
+    
+    # Send the recorded scan to WebSocket clients
+    await manager.broadcast(scan_data)
+    
+    return scan_data
 
 @app.websocket("/ws")
 async def websocket_endpoint(websocket: WebSocket):
@@ -246,23 +260,7 @@ async def websocket_endpoint(websocket: WebSocket):
     await manager.connect(websocket)
     
     try:
-        # Define the callback function for scan events
-        async def on_scan(scan_data):
-            try:
-                # Find asset information
-                db = next(get_db())
-                asset = db.query(Asset).filter(Asset.tag_id == scan_data["tag_id"]).first()
-                if asset:
-                    scan_data["asset_name"] = asset.name
-                    scan_data["asset_type"] = asset.asset_type
-                await manager.send_message(scan_data, websocket)
-            except Exception as e:
-                logger.error(f"Error in WebSocket callback: {str(e)}")
-        
-        # Subscribe to scan events
-        subscriber_id = simulator.subscribe(on_scan)
-        
-        # Keep the connection open
+        # Keep the connection open; scan events arrive through manager.broadcast
         while True:
             await websocket.receive_text()
     except WebSocketDisconnect:
@@ -271,31 +269,29 @@ async def websocket_endpoint(websocket: WebSocket):
         logger.error(f"WebSocket error: {str(e)}")
     finally:
         manager.disconnect(websocket)
-        simulator.unsubscribe(subscriber_id)
 
 # Mark assets as missing if not seen for a while
 @app.get("/api/maintenance/update-status")
 def update_asset_status(db: Session = Depends(get_db)):
     """Update asset statuses based on last seen time"""
-    assets = db.query(Asset).all()
-    now = datetime.utcnow()
-    threshold = timedelta(hours=24)
+    # Computed by SQLite so it matches the stored timestamp format
+    cutoff = utc_now("-24 hours")
+    
+    # If not seen in 24 hours, mark as missing
+    marked_missing = db.execute(
+        update(Asset)
+        .where(Asset.last_seen_at < cutoff, Asset.status != "missing")
+        .values(status="missing")
+    )
     
-    updated_count = 0
-    for asset in assets:
-        last_scan = db.query(Scan).filter(Scan.asset_id == asset.id).order_by(Scan.timestamp.desc()).first()
-        if last_scan:
-            time_since_last_scan = now - last_scan.timestamp
-            
-            # If not seen in 24 hours, mark as missing
-            if time_since_last_scan > threshold and asset.status != "missing":
-                asset.status = "missing"
-                updated_count += 1
-            # If seen recently but marked as missing, update to active
-            elif time_since_last_scan <= threshold and asset.status == "missing":
-                asset.status = "active"
-                updated_count += 1
+    # If seen recently but marked as missing, update to active
+    marked_active = db.execute(
+        update(Asset)
+        .where(Asset.last_seen_at >= cutoff, Asset.status == "missing")
+        .values(status="active")
+    )
     
+    updated_count = marked_missing.rowcount + marked_active.rowcount
     db.commit()
     return {"message": f"Updated status for {updated_count} assets"}
 
@@ -1,33 +1,28 @@
-import json
 import random
 import asyncio
 import logging
 from datetime import datetime
-from typing import List, Dict, Any, Optional
-import json
+from typing import List, Dict, Any, Optional, Callable
 
-# Load config
-with open("config.json", "r") as f:
-    config = json.load(f)
+from config import config
 
-# Set up logging
-logging.basicConfig(
-    level=getattr(logging, config.get("log_level", "INFO").upper()),
-    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
-)
 logger = logging.getLogger("mock_rfid")
 
+# Tag IDs used when no real assets are known
+MOCK_TAG_IDS = [f"RF{i:03d}" for i in range(1, 6)]
+
 class RFIDSimulator:
     """
     Simulates RFID scanning events for testing and demonstration purposes
     """
     
-    def __init__(self, db_session=None):
+    def __init__(self):
         self.locations = config.get("default_locations", ["Office", "Warehouse", "Meeting Room"])
-        self.db_session = db_session
         self.running = False
         self.scan_task = None
-        self.subscribers = []
+        self.subscribers: Dict[int, Callable] = {}
+        self._next_subscriber_id = 0
+        self.tag_ids = []  # Known asset tag IDs, kept up to date by the API
     
     async def start_simulation(self):
         """Start automatic scan simulation"""
@@ -67,46 +62,53 @@ class RFIDSimulator:
             raise
     
     def subscribe(self, callback):
-        """Subscribe to scan events"""
-        self.subscribers.append(callback)
-        return len(self.subscribers) - 1
+        """Subscribe to scan events, returning a token for unsubscribe"""
+        subscriber_id = self._next_subscriber_id
+        self._next_subscriber_id += 1
+        self.subscribers[subscriber_id] = callback
+        return subscriber_id
     
-    def unsubscribe(self, index):
+    def unsubscribe(self, subscriber_id):
         """Unsubscribe from scan events"""
-        if 0 <= index < len(self.subscribers):
-            self.subscribers.pop(index)
+        self.subscribers.pop(subscriber_id, None)
     
     async def notify_subscribers(self, scan_data):
         """Notify all subscribers of new scan data"""
-        for callback in self.subscribers:
+        # Snapshot so callbacks can unsubscribe while we await them
+        sync_callbacks, async_callbacks = [], []
+        for callback in tuple(self.subscribers.values()):
+            if asyncio.iscoroutinefunction(callback):
+                async_callbacks.append(callback)
+            else:
+                sync_callbacks.append(callback)
+        
+        for callback in sync_callbacks:
             try:
-                if asyncio.iscoroutinefunction(callback):
-                    await callback(scan_data)
-                else:
-                    callback(scan_data)
+                callback(scan_data)
             except Exception as e:
                 logger.error(f"Error notifying subscriber: {str(e)}")
+        
+        # Run async subscribers concurrently so one slow client doesn't delay the rest
+        results = await asyncio.gather(
+            *(callback(scan_data) for callback in async_callbacks),
+            return_exceptions=True,
+        )
+        for result in results:
+            if isinstance(result, Exception):
+                logger.error(f"Error notifying subscriber: {str(result)}")
     
     async def generate_random_scan(self) -> Dict[str, Any]:
         """
         Generate a random RFID scan event
         """
-        # If we have a database session, use real tag IDs
-        tag_ids = []
-        if self.db_session:
-            from .db import Asset
-            assets = self.db_session.query(Asset).all()
-            tag_ids = [asset.tag_id for asset in assets]
-        
         # Fallback to mock IDs if no database or empty
-        if not tag_ids:
-            tag_ids = [f"RF{i:03d}" for i in range(1, 6)]
+        tag_ids = self.tag_ids or MOCK_TAG_IDS
         
         # Create scan data
         scan_data = {
             "tag_id": random.choice(tag_ids),
             "location": random.choice(self.locations),
-            "timestamp": datetime.utcnow().isoformat(),
+            "timestamp": datetime.utcnow(),
             "rssi": random.randint(-70, -30),  # Simulated signal strength
         }
         
@@ -121,7 +123,7 @@ class RFIDSimulator:
         scan_data = {
             "tag_id": tag_id,
             "location": location,
-            "timestamp": datetime.utcnow().isoformat(),
+            "timestamp": datetime.utcnow(),
             "rssi": random.randint(-70, -30),  # Simulated signal strength
         }
         